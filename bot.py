@@ -2,7 +2,7 @@ import os
 import logging
 from telethon import TelegramClient, events, Button
 from telethon.tl.types import DocumentAttributeVideo, DocumentAttributeAudio
-from video_processor import VideoProcessor
+from video_processor import VideoProcessor, parse_time_ranges, format_timestamp
 import asyncio
 
 # Enable logging
@@ -17,17 +17,32 @@ API_ID = int(os.getenv('API_ID', '24663402'))
 API_HASH = os.getenv('API_HASH', '3ca4ba0a56c360004a0048d51d385529')
 BOT_TOKEN = os.getenv('BOT_TOKEN', '7555240264:AAHeRCnbGIjGMEq8To1Cx74vICy3Qf4jiZY')
 
+# Keep the session on a persistent volume to skip re-login on restart
+SESSION_PATH = os.getenv('SESSION_PATH', 'bot_session')
+
+MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB in bytes
+
+# Album files fetched at once
+MAX_PARALLEL_DOWNLOADS = int(os.getenv('MAX_PARALLEL_DOWNLOADS', '3'))
+# Bandwidth cap shared by all of a user's downloads (MB/s, 0 = unlimited)
+USER_DOWNLOAD_LIMIT_MB = float(os.getenv('USER_DOWNLOAD_LIMIT_MB', '0'))
+
 class VideoMergerBot:
     def __init__(self):
-        self.client = TelegramClient('bot_session', API_ID, API_HASH)
+        self.client = TelegramClient(SESSION_PATH, API_ID, API_HASH)
         self.processor = VideoProcessor()
         self.user_data = {}
+        self.download_pacing = {}
+        self.benchmark_task = None
         
     async def start(self):
         """Start the bot"""
+        # Probe FFmpeg while logging in, it must finish before jobs are accepted
+        preflight = asyncio.create_task(self.run_preflight())
         await self.client.start(bot_token=BOT_TOKEN)
         logger.info("✅ Bot started successfully with MTProto API!")
         logger.info(f"✅ Supporting files up to 2GB!")
+        await preflight
         
         # Register handlers
         self.client.add_event_handler(self.start_command, events.NewMessage(pattern='/start'))
@@ -37,9 +52,31 @@ class VideoMergerBot:
         self.client.add_event_handler(self.cancel_command, events.NewMessage(pattern='/cancel'))
         self.client.add_event_handler(self.button_callback, events.CallbackQuery())
         self.client.add_event_handler(self.handle_media, events.NewMessage(func=lambda e: e.media))
+        self.client.add_event_handler(self.handle_album, events.Album())
         
         logger.info("✅ All handlers registered")
         
+        # Preset speeds are only needed for encode profiles, measure them in the background
+        if self.processor.needs_benchmark():
+            self.benchmark_task = asyncio.create_task(self.run_benchmark())
+    
+    async def run_preflight(self):
+        """Check FFmpeg versions, encoders and filters off the event loop"""
+        try:
+            await asyncio.to_thread(self.processor.preflight)
+        except Exception as e:
+            logger.error(f"FFmpeg preflight failed: {e}", exc_info=True)
+    
+    async def run_benchmark(self):
+        """Measure encode preset speeds without blocking the bot"""
+        try:
+            # Wait for a quiet moment so jobs and the benchmark don't share the CPU
+            while self.processor.active_encodes > 0:
+                await asyncio.sleep(10)
+            await asyncio.to_thread(self.processor.benchmark)
+        except Exception as e:
+            logger.error(f"FFmpeg benchmark failed: {e}", exc_info=True)
+        
     async def start_command(self, event):
         """Handle /start command"""
         welcome_message = (
@@ -48,7 +85,8 @@ class VideoMergerBot:
             "• Merge multiple videos\n"
             "• Add audio to videos\n"
             "• Add subtitles to videos\n"
-            "• Extract audio from videos\n\n"
+            "• Extract audio from videos\n"
+            "• Cut clips from videos and merge them\n\n"
             "✅ **Max file size: 2GB per file** (using MTProto API)\n\n"
             "Use /tools to get started!\n"
             "Use /help for more information."
@@ -82,6 +120,7 @@ class VideoMergerBot:
             [Button.inline("🔊 Video + Audio", b"video_audio")],
             [Button.inline("📝 Video + Subtitle", b"video_subtitle")],
             [Button.inline("🎵 Audio Extractor", b"audio_extract")],
+            [Button.inline("✂️ Trim + Merge", b"video_trim")],
         ]
         await event.respond("🛠️ **Select a tool:**", buttons=buttons)
         
@@ -103,6 +142,7 @@ class VideoMergerBot:
         user_id = event.sender_id
         
         if user_id in self.user_data:
+            self.cancel_downloads(self.user_data[user_id])
             files = self.user_data[user_id].get('files', [])
             self.cleanup_files(files)
             del self.user_data[user_id]
@@ -124,10 +164,21 @@ class VideoMergerBot:
             await event.edit("📹 Send more videos to merge!")
             return
         
+        # Reject tools this host's FFmpeg can't run before anything is downloaded
+        if not self.processor.supports_mode(data):
+            await event.edit(
+                "❌ This tool is not available right now.\n\n"
+                "The server's FFmpeg is missing a required feature. Please try another tool."
+            )
+            return
+        
         # Initialize user data for tool selection
+        if user_id in self.user_data:
+            self.cancel_downloads(self.user_data[user_id])
         self.user_data[user_id] = {
             'mode': data,
-            'files': []
+            'files': [],
+            'ranges': []
         }
         
         # Send instructions based on selected mode
@@ -135,7 +186,8 @@ class VideoMergerBot:
             'video_video': "📹 **Video + Video Merger**\n\nSend me 2 or more videos to merge them into one.\n\n✅ Max file size: 2GB per file\n\nUse /cancel to stop.",
             'video_audio': "🔊 **Video + Audio Merger**\n\nSend me:\n1. A video file\n2. An audio file\n\nI'll replace the video's audio.\n\n✅ Max file size: 2GB per file\n\nUse /cancel to stop.",
             'video_subtitle': "📝 **Video + Subtitle**\n\nSend me:\n1. A video file\n2. A subtitle file (.srt)\n\nI'll add subtitles to your video.\n\n✅ Max file size: 2GB per file\n\nUse /cancel to stop.",
-            'audio_extract': "🎵 **Audio Extractor**\n\nSend me a video file and I'll extract the audio for you.\n\n✅ Max file size: 2GB per file\n\nUse /cancel to stop."
+            'audio_extract': "🎵 **Audio Extractor**\n\nSend me a video file and I'll extract the audio for you.\n\n✅ Max file size: 2GB per file\n\nUse /cancel to stop.",
+            'video_trim': "✂️ **Trim + Merge**\n\nSend me videos with the parts to keep in the caption, e.g.\n`0:30-1:45, 1:02:00-1:03:10`\n\nThe clips are cut exactly and merged in order.\n\n✅ Max file size: 2GB per file\n\nUse /cancel to stop."
         }
         
         await event.edit(instructions[data])
@@ -150,21 +202,16 @@ class VideoMergerBot:
         
         mode = self.user_data[user_id]['mode']
         
+        # Albums of videos are collected and merged by handle_album
+        if mode == 'video_video' and event.message.grouped_id:
+            return
+        
         try:
             # Get file info
             media = event.media
-            file_size = 0
-            file_name = None
             
             if hasattr(media, 'document'):
-                file_size = media.document.size
-                # Get filename from attributes
-                for attr in media.document.attributes:
-                    if hasattr(attr, 'file_name'):
-                        file_name = attr.file_name
-                        break
-                if not file_name:
-                    file_name = f"file_{len(self.user_data[user_id]['files'])}_{media.document.id}"
+                file_name, file_size = self.get_file_info(media, len(self.user_data[user_id]['files']))
             elif hasattr(media, 'photo'):
                 await event.respond("❌ Please send videos/audio as files, not photos!")
                 return
@@ -172,8 +219,29 @@ class VideoMergerBot:
                 await event.respond("❌ Unsupported file type!")
                 return
             
+            # Time ranges come from the caption, check them before downloading
+            ranges = None
+            if mode == 'video_trim':
+                try:
+                    ranges = parse_time_ranges(event.message.message or '')
+                    # Telegram reports video length, catch ranges past the end before downloading
+                    for attr in media.document.attributes:
+                        if isinstance(attr, DocumentAttributeVideo) and attr.duration:
+                            for start, end in ranges:
+                                if start >= attr.duration:
+                                    raise ValueError(
+                                        f"Range {format_timestamp(start)}-{format_timestamp(end)} starts after "
+                                        f"the end of the video ({format_timestamp(attr.duration)} long)"
+                                    )
+                except ValueError as e:
+                    await event.respond(
+                        f"❌ {e}\n\n"
+                        "Please resend the video with the parts to keep in the caption, e.g.\n"
+                        "`0:30-1:45, 1:02:00-1:03:10`"
+                    )
+                    return
+            
             # Check file size (2GB = 2147483648 bytes)
-            MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB in bytes
             if file_size > MAX_FILE_SIZE:
                 size_mb = file_size / (1024 * 1024)
                 await event.respond(
@@ -198,7 +266,12 @@ class VideoMergerBot:
             last_progress = [0]
             last_update_time = [asyncio.get_event_loop().time()]
             
-            def progress_callback(current, total):
+            last_bytes = [0]
+            
+            async def progress_callback(current, total):
+                await self.throttle_download(user_id, current - last_bytes[0])
+                last_bytes[0] = current
+                
                 percent = int((current / total) * 100)
                 current_time = asyncio.get_event_loop().time()
                 
@@ -229,6 +302,8 @@ class VideoMergerBot:
             )
             
             self.user_data[user_id]['files'].append(file_path)
+            if ranges:
+                self.user_data[user_id]['ranges'].append(ranges)
             
             # Update status
             await status_msg.edit(
@@ -248,6 +323,8 @@ class VideoMergerBot:
                 should_process = True
             elif mode == 'video_subtitle' and len(self.user_data[user_id]['files']) >= 2:
                 should_process = True
+            elif mode == 'video_trim' and len(self.user_data[user_id]['files']) >= 1:
+                should_process = True
             
             if should_process:
                 # Ask user if they want to process or add more files
@@ -261,12 +338,180 @@ class VideoMergerBot:
                         "What would you like to do?",
                         buttons=buttons
                     )
+                elif mode == 'video_trim':
+                    clip_count = sum(len(r) for r in self.user_data[user_id]['ranges'])
+                    buttons = [
+                        [Button.inline("✂️ Cut & Merge Now", b"process_now")],
+                        [Button.inline("➕ Add More Videos", b"add_more")],
+                    ]
+                    await event.respond(
+                        f"✅ Ready to cut {clip_count} clips from {len(self.user_data[user_id]['files'])} videos!\n\n"
+                        "What would you like to do?",
+                        buttons=buttons
+                    )
                 else:
                     await self.process_files(event, user_id)
         
         except Exception as e:
             logger.error(f"Error downloading file: {e}", exc_info=True)
             await event.respond(f"❌ Error downloading file: {str(e)}")
+    
+    async def handle_album(self, event):
+        """Download a forwarded album of videos concurrently and merge it"""
+        user_id = event.sender_id
+        
+        if user_id not in self.user_data or self.user_data[user_id]['mode'] != 'video_video':
+            return
+        session = self.user_data[user_id]
+        
+        try:
+            # Collect the documents in album order, skipping anything we can't merge
+            items = []
+            skipped = []
+            index = len(self.user_data[user_id]['files'])
+            for message in event.messages:
+                if not hasattr(message.media, 'document'):
+                    skipped.append("photo/unsupported item")
+                    continue
+                file_name, file_size = self.get_file_info(message.media, index + len(items))
+                if file_size > MAX_FILE_SIZE:
+                    skipped.append(f"{file_name} (over 2GB)")
+                    continue
+                items.append((message, file_name, file_size))
+            
+            if not items:
+                await event.respond("❌ No videos in this album could be downloaded!")
+                return
+            
+            total_size = sum(size for _, _, size in items)
+            total_mb = total_size / (1024 * 1024)
+            status_msg = await event.respond(
+                f"📦 Album: {len(items)} files\n"
+                f"📊 Size: {total_mb:.1f} MB\n"
+                f"⬇️ Starting download..."
+            )
+            
+            os.makedirs('downloads', exist_ok=True)
+            
+            loop = asyncio.get_event_loop()
+            progress = [0] * len(items)
+            done = [0]
+            last_update_time = [loop.time()]
+            semaphore = asyncio.Semaphore(MAX_PARALLEL_DOWNLOADS)
+            
+            def make_progress_callback(idx):
+                async def progress_callback(current, total):
+                    chunk = current - progress[idx]
+                    progress[idx] = current
+                    downloaded = sum(progress)
+                    current_time = loop.time()
+                    
+                    await self.throttle_download(user_id, chunk)
+                    
+                    # One aggregated message, updated every 2 seconds
+                    if (current_time - last_update_time[0]) >= 2:
+                        last_update_time[0] = current_time
+                        percent = int((downloaded / total_size) * 100)
+                        bar_length = 20
+                        filled = int(bar_length * percent / 100)
+                        bar = '█' * filled + '░' * (bar_length - filled)
+                        
+                        asyncio.create_task(status_msg.edit(
+                            f"📦 Album: {len(items)} files ({done[0]} done)\n"
+                            f"📊 Size: {total_mb:.1f} MB\n"
+                            f"⬇️ Downloading: {percent}%\n"
+                            f"{bar}\n"
+                            f"📥 {downloaded / (1024 * 1024):.1f} / {total_mb:.1f} MB"
+                        ))
+                return progress_callback
+            
+            async def download(idx, message, file_name):
+                async with semaphore:
+                    # Album items often share a file name, keep their paths apart
+                    file_path = os.path.join('downloads', f"{message.media.document.id}_{file_name}")
+                    try:
+                        await self.client.download_media(
+                            message,
+                            file=file_path,
+                            progress_callback=make_progress_callback(idx)
+                        )
+                    except BaseException:
+                        # Also runs when /cancel cancels the download
+                        self.cleanup_files([file_path])
+                        raise
+                    done[0] += 1
+                    return file_path
+            
+            # Kept in the session so /cancel can stop them
+            tasks = [
+                asyncio.create_task(download(idx, message, file_name))
+                for idx, (message, file_name, _) in enumerate(items)
+            ]
+            session.setdefault('downloads', []).extend(tasks)
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            for task in tasks:
+                if task in session['downloads']:
+                    session['downloads'].remove(task)
+            
+            # User may have cancelled, or cancelled and started over, while the album was downloading
+            downloaded_files = [r for r in results if isinstance(r, str)]
+            if self.user_data.get(user_id) is not session:
+                self.cleanup_files(downloaded_files)
+                return
+            
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Error downloading album file: {result}", exc_info=result)
+                    skipped.append(f"download failed: {str(result)[:50]}")
+            
+            session['files'].extend(downloaded_files)
+            files = session['files']
+            
+            summary = (
+                f"✅ Album downloaded!\n"
+                f"📁 {len(downloaded_files)} of {len(event.messages)} files\n"
+                f"📊 Size: {total_mb:.1f} MB"
+            )
+            if skipped:
+                summary += "\n⚠️ Skipped: " + ", ".join(skipped)
+            await status_msg.edit(summary)
+            
+            if len(files) >= 2:
+                await self.process_files(event, user_id)
+            else:
+                await event.respond("📹 Send more videos to merge!")
+        
+        except Exception as e:
+            logger.error(f"Error downloading album: {e}", exc_info=True)
+            await event.respond(f"❌ Error downloading album: {str(e)}")
+    
+    def cancel_downloads(self, session):
+        """Stop album downloads still running for a session"""
+        for task in session.get('downloads', []):
+            task.cancel()
+    
+    async def throttle_download(self, user_id, chunk):
+        """Hold a download back so all of a user's downloads share USER_DOWNLOAD_LIMIT_MB"""
+        if USER_DOWNLOAD_LIMIT_MB <= 0 or chunk <= 0:
+            return
+        now = asyncio.get_event_loop().time()
+        # Each chunk reserves its transfer time after the user's previous chunks
+        next_free = max(now, self.download_pacing.get(user_id, now))
+        next_free += chunk / (USER_DOWNLOAD_LIMIT_MB * 1024 * 1024)
+        self.download_pacing[user_id] = next_free
+        if next_free > now:
+            await asyncio.sleep(next_free - now)
+    
+    def get_file_info(self, media, index):
+        """Get file name and size of a document"""
+        file_name = None
+        for attr in media.document.attributes:
+            if hasattr(attr, 'file_name'):
+                file_name = attr.file_name
+                break
+        if not file_name:
+            file_name = f"file_{index}_{media.document.id}"
+        return file_name, media.document.size
             
     async def process_files(self, event, user_id):
         """Process files based on mode"""
@@ -315,6 +560,17 @@ class VideoMergerBot:
                 output_file = await self.processor.add_subtitles(files[0], files[1], status_msg_event)
                 caption = "✅ Subtitles burned into video successfully!"
                 
+            elif mode == 'video_trim':
+                ranges = self.user_data[user_id]['ranges']
+                if hasattr(status_msg_event, 'edit'):
+                    await status_msg_event.edit(
+                        "🔄 Trimming Videos\n"
+                        f"✂️ Clips: {sum(len(r) for r in ranges)} from {len(files)} videos\n"
+                        "⏳ Cutting at exact frames..."
+                    )
+                output_file = await self.processor.trim_videos(files, ranges, status_msg_event)
+                caption = "✅ Clips cut and merged successfully!"
+                
             elif mode == 'audio_extract':
                 if hasattr(status_msg_event, 'edit'):
                     await status_msg_event.edit(
@@ -1,10 +1,101 @@
 import subprocess
 import os
+import math
+import json
+import shutil
+import tempfile
+import time
 import logging
 import asyncio
 
 logger = logging.getLogger(__name__)
 
+# Target wall-clock time for a single encode job (seconds)
+ENCODE_TARGET_SECONDS = int(os.getenv('ENCODE_TARGET_SECONDS', '900'))
+
+# x264 presets from best quality to fastest, with the CRF used for each and a
+# starting guess of encode speed (media seconds per wall second at 1080p using
+# the whole host). The guesses are replaced by measured speeds after each job.
+ENCODE_PRESETS = [
+    ('faster', 23, 1.0),
+    ('veryfast', 23, 1.5),
+    ('superfast', 24, 2.5),
+    ('ultrafast', 26, 4.0),
+]
+
+# Heights tried, in order, when no preset meets the deadline at native size
+DOWNSCALE_HEIGHTS = [720, 480]
+
+REFERENCE_PIXELS = 1920 * 1080
+
+# FFmpeg encoders and filters each tool needs
+MODE_REQUIREMENTS = {
+    'video_video': {'encoders': ['libx264', 'aac'], 'filters': ['scale']},
+    'video_audio': {'encoders': ['libx264', 'aac'], 'filters': ['scale']},
+    'video_subtitle': {'encoders': ['libx264'], 'filters': ['subtitles', 'scale']},
+    'audio_extract': {'encoders': [], 'filters': []},
+    'video_trim': {'encoders': ['libx264', 'aac'], 'filters': ['scale']},
+}
+
+# Length of the synthetic 1080p clip used to benchmark each preset (seconds)
+BENCHMARK_SECONDS = 2
+
+# Initial window searched for the keyframe next to a cut point (seconds), doubled until found
+KEYFRAME_WINDOW_SECONDS = 30
+
+# ffprobe H.264 profile names and the matching libx264 -profile:v values
+X264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+
+def parse_time_ranges(text: str) -> list:
+    """Parse "0:30-1:45, 1:02:00-1:03:10" into [(start, end), ...] in seconds"""
+    ranges = []
+    for part in text.replace(';', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' not in part:
+            raise ValueError(f"Range '{part}' must look like START-END")
+        start_text, end_text = part.split('-', 1)
+        start, end = parse_timestamp(start_text), parse_timestamp(end_text)
+        if end <= start:
+            raise ValueError(f"Range '{part}' ends before it starts")
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("No time ranges given")
+    return ranges
+
+def parse_timestamp(text: str) -> float:
+    """Parse SS, MM:SS or HH:MM:SS (with optional fractions) into seconds"""
+    fields = text.strip().split(':')
+    if len(fields) > 3:
+        raise ValueError(f"Invalid time '{text.strip()}'")
+    try:
+        seconds = 0.0
+        for field in fields:
+            seconds = seconds * 60 + float(field)
+    except ValueError:
+        raise ValueError(f"Invalid time '{text.strip()}'")
+    # float() also accepts "nan" and "inf"
+    if not math.isfinite(seconds) or seconds < 0:
+        raise ValueError(f"Invalid time '{text.strip()}'")
+    return seconds
+
+def format_timestamp(seconds: float) -> str:
+    """Format seconds as H:MM:SS or M:SS for messages"""
+    minutes, secs = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:04.1f}"
+    return f"{minutes}:{secs:04.1f}"
+
 class VideoProcessor:
     """Handle all video processing operations using FFmpeg"""
     
@@ -13,6 +104,349 @@ class VideoProcessor:
         self.output_dir = 'output'
         os.makedirs(self.temp_dir, exist_ok=True)
         os.makedirs(self.output_dir, exist_ok=True)
+        self.encode_speeds = {preset: speed for preset, _, speed in ENCODE_PRESETS}
+        self.active_encodes = 0
+        self.encodes_started = 0
+        self.job_measured_presets = set()
+        self.capabilities = None
+        self.capabilities_file = os.getenv(
+            'CAPABILITIES_CACHE', os.path.join(self.temp_dir, 'ffmpeg_capabilities.json')
+        )
+    
+    def preflight(self) -> dict:
+        """Probe FFmpeg versions, encoders and filters, reusing the on-disk cache when valid"""
+        ffmpeg_version = self.tool_version('ffmpeg')
+        ffprobe_version = self.tool_version('ffprobe')
+        cpu_count = os.cpu_count() or 1
+        
+        try:
+            with open(self.capabilities_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if (cached.get('ffmpeg') == ffmpeg_version and cached.get('ffprobe') == ffprobe_version
+                    and cached.get('cpu_count') == cpu_count):
+                logger.info(f"✅ Using cached FFmpeg capabilities: {self.capabilities_file}")
+                self.apply_capabilities(cached)
+                return cached
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable capabilities cache: {e}")
+        
+        capabilities = {
+            'ffmpeg': ffmpeg_version,
+            'ffprobe': ffprobe_version,
+            'cpu_count': cpu_count,
+            'encoders': [],
+            'filters': [],
+            'encode_speeds': {},
+        }
+        
+        if ffmpeg_version:
+            capabilities['encoders'] = self.list_ffmpeg_names('-encoders')
+            capabilities['filters'] = self.list_ffmpeg_names('-filters')
+        else:
+            logger.error("FFmpeg not found, processing will not work")
+        
+        logger.info(
+            f"✅ FFmpeg capabilities: {ffmpeg_version}, "
+            f"{len(capabilities['encoders'])} encoders, {len(capabilities['filters'])} filters"
+        )
+        self.apply_capabilities(capabilities)
+        # Without libx264 there is nothing to benchmark, cache right away
+        if not self.needs_benchmark():
+            self.save_capabilities()
+        return capabilities
+    
+    def needs_benchmark(self) -> bool:
+        """Whether preset speeds still have to be measured on this host"""
+        return (
+            self.capabilities is not None
+            and 'libx264' in self.capabilities.get('encoders', [])
+            and not self.capabilities.get('encode_speeds')
+        )
+    
+    def benchmark(self):
+        """Measure preset speeds, apply them and update the cache"""
+        speeds = self.benchmark_presets()
+        self.capabilities['encode_speeds'] = speeds
+        # Speeds already measured on real jobs since startup are kept
+        for preset, speed in speeds.items():
+            if preset not in self.job_measured_presets:
+                self.encode_speeds[preset] = speed
+        self.save_capabilities()
+    
+    def save_capabilities(self):
+        """Write the capabilities to the on-disk cache"""
+        try:
+            with open(self.capabilities_file, 'w', encoding='utf-8') as f:
+                json.dump(self.capabilities, f, indent=2)
+        except Exception as e:
+            logger.warning(f"Could not write capabilities cache: {e}")
+    
+    def apply_capabilities(self, capabilities: dict):
+        """Use probed capabilities and measured preset speeds"""
+        self.capabilities = capabilities
+        for preset, speed in capabilities.get('encode_speeds', {}).items():
+            if preset in self.encode_speeds and speed > 0:
+                self.encode_speeds[preset] = speed
+    
+    def tool_version(self, tool: str):
+        """First line of `<tool> -version`, or None if it can't run"""
+        try:
+            result = subprocess.run([tool, '-version'], capture_output=True, text=True)
+            if result.returncode == 0 and result.stdout:
+                return result.stdout.splitlines()[0].strip()
+        except OSError:
+            pass
+        return None
+    
+    def list_ffmpeg_names(self, option: str) -> list:
+        """Names listed by `ffmpeg -encoders` or `ffmpeg -filters`"""
+        result = subprocess.run(['ffmpeg', '-hide_banner', option], capture_output=True, text=True)
+        names = []
+        for line in result.stdout.splitlines():
+            parts = line.split()
+            # Entries are "<flags> <name> <description>", legend lines are "<flag> = <meaning>"
+            if len(parts) >= 2 and parts[1] != '=':
+                names.append(parts[1])
+        return names
+    
+    def benchmark_presets(self) -> dict:
+        """Measure encode speed of each preset on this host"""
+        source = [
+            'ffmpeg',
+            '-hide_banner',
+            '-f', 'lavfi',
+            '-i', f'testsrc2=size=1920x1080:rate=30:duration={BENCHMARK_SECONDS}',
+        ]
+        
+        # Time generating the test clip alone so only the encode is counted
+        started = time.monotonic()
+        subprocess.run([*source, '-f', 'null', '-'], capture_output=True, text=True)
+        generate_time = time.monotonic() - started
+        
+        speeds = {}
+        for preset, crf, _ in ENCODE_PRESETS:
+            cmd = [
+                *source,
+                '-c:v', 'libx264',
+                '-preset', preset,
+                '-crf', str(crf),
+                '-f', 'null',
+                '-'
+            ]
+            encodes_before = self.encodes_started
+            started = time.monotonic()
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            elapsed = time.monotonic() - started - generate_time
+            # A job encoding at the same time would skew the measurement
+            if self.active_encodes > 0 or self.encodes_started != encodes_before:
+                logger.info(f"Benchmark {preset} skipped, a job was encoding")
+                continue
+            if result.returncode == 0 and elapsed > 0:
+                speeds[preset] = BENCHMARK_SECONDS / elapsed
+                logger.info(f"Benchmark {preset}: {speeds[preset]:.2f}x realtime at 1080p")
+        return speeds
+    
+    def supports_mode(self, mode: str) -> bool:
+        """Whether this host's FFmpeg can run a tool (True until preflight has run)"""
+        if self.capabilities is None:
+            return True
+        if not self.capabilities.get('ffmpeg'):
+            return False
+        requirements = MODE_REQUIREMENTS.get(mode, {})
+        return (
+            all(e in self.capabilities['encoders'] for e in requirements.get('encoders', []))
+            and all(f in self.capabilities['filters'] for f in requirements.get('filters', []))
+        )
+    
+    def probe_video(self, video_file: str) -> dict:
+        """Get duration, resolution and stream formats of a video using ffprobe"""
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-show_entries',
+            'stream=codec_type,codec_name,profile,width,height,pix_fmt,r_frame_rate,sample_rate,channels'
+            ':format=duration,start_time',
+            '-of', 'json',
+            video_file
+        ]
+        info = {
+            'duration': 0.0, 'start_time': 0.0, 'width': 0, 'height': 0,
+            'video_codec': None, 'video_profile': None, 'pix_fmt': None, 'frame_rate': 0.0,
+            'audio_codec': None, 'sample_rate': 0, 'channels': 0,
+        }
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            data = json.loads(result.stdout or '{}')
+            info['duration'] = float(data.get('format', {}).get('duration') or 0)
+            info['start_time'] = float(data.get('format', {}).get('start_time') or 0)
+            for stream in data.get('streams', []):
+                if stream.get('codec_type') == 'video' and not info['video_codec']:
+                    info['video_codec'] = stream.get('codec_name')
+                    info['width'] = int(stream.get('width') or 0)
+                    info['height'] = int(stream.get('height') or 0)
+                    info['video_profile'] = stream.get('profile')
+                    info['pix_fmt'] = stream.get('pix_fmt')
+                    num, _, den = (stream.get('r_frame_rate') or '0/1').partition('/')
+                    if float(den or 1) > 0:
+                        info['frame_rate'] = float(num) / float(den or 1)
+                elif stream.get('codec_type') == 'audio' and not info['audio_codec']:
+                    info['audio_codec'] = stream.get('codec_name')
+                    info['sample_rate'] = int(stream.get('sample_rate') or 0)
+                    info['channels'] = int(stream.get('channels') or 0)
+        except Exception as e:
+            logger.warning(f"Could not probe {video_file}: {e}")
+        return info
+    
+    def select_encode_profile(self, duration: float, width: int, height: int) -> dict:
+        """Pick preset, CRF, threads and scaling to finish within the deadline"""
+        # Encodes already running share the CPU with this one
+        jobs = self.active_encodes + 1
+        cpu_count = os.cpu_count() or 1
+        profile = {
+            'preset': 'veryfast',
+            'crf': 23,
+            'threads': max(1, cpu_count // jobs),
+            'scale_height': None,
+            'jobs': jobs,
+        }
+        
+        if duration <= 0 or width <= 0 or height <= 0:
+            logger.info(f"Unknown input size, using default encode profile: {profile}")
+            return profile
+        
+        heights = [None] + [h for h in DOWNSCALE_HEIGHTS if h < height]
+        for scale_height in heights:
+            out_height = scale_height or height
+            out_width = width * out_height / height
+            pixel_ratio = (out_width * out_height) / REFERENCE_PIXELS
+            for preset, crf, _ in ENCODE_PRESETS:
+                estimate = duration * pixel_ratio * jobs / self.encode_speeds[preset]
+                profile.update(preset=preset, crf=crf, scale_height=scale_height)
+                if estimate <= ENCODE_TARGET_SECONDS:
+                    logger.info(
+                        f"Encode profile: {profile} "
+                        f"(estimated {estimate:.0f}s, target {ENCODE_TARGET_SECONDS}s)"
+                    )
+                    return profile
+        
+        # Nothing meets the deadline: fastest preset at the smallest size
+        logger.warning(f"No profile meets {ENCODE_TARGET_SECONDS}s target, using {profile}")
+        return profile
+    
+    def encode_args(self, profile: dict) -> list:
+        """FFmpeg video encoder arguments for an encode profile"""
+        return [
+            '-c:v', 'libx264',
+            '-preset', profile['preset'],
+            '-crf', str(profile['crf']),
+            '-threads', str(profile['threads']),
+        ]
+    
+    def scale_filter(self, profile: dict):
+        """Scale filter for an encode profile, or None to keep native size"""
+        if profile['scale_height']:
+            return f"scale=-2:{profile['scale_height']}"
+        return None
+    
+    async def run_encode(self, cmd: list, profile: dict, duration: float, pixels: int, timeout=None):
+        """Run an FFmpeg encode off the event loop and record its speed"""
+        self.active_encodes += 1
+        self.encodes_started += 1
+        started = time.monotonic()
+        try:
+            result = await asyncio.to_thread(
+                subprocess.run, cmd, capture_output=True, text=True, timeout=timeout
+            )
+        finally:
+            self.active_encodes -= 1
+        elapsed = time.monotonic() - started
+        
+        if result.returncode == 0 and duration > 0 and pixels > 0 and elapsed > 0:
+            # Normalize to 1080p on an otherwise idle host
+            measured = duration * (pixels / REFERENCE_PIXELS) * profile['jobs'] / elapsed
+            preset = profile['preset']
+            self.encode_speeds[preset] = 0.5 * self.encode_speeds[preset] + 0.5 * measured
+            self.job_measured_presets.add(preset)
+            logger.info(f"Measured {preset} speed: {measured:.2f}x (avg {self.encode_speeds[preset]:.2f}x)")
+        return result
+    
+    def output_pixels(self, profile: dict, width: int, height: int) -> int:
+        """Pixel count of the encoded output for a profile"""
+        if profile['scale_height'] and height > 0:
+            return int(width * profile['scale_height'] / height) * profile['scale_height']
+        return width * height
+    
+    async def concat_via_mpegts(self, video_files: list, output_file: str) -> bool:
+        """Losslessly merge videos by remuxing each to MPEG-TS and concatenating"""
+        probes = await asyncio.gather(*(asyncio.to_thread(self.probe_video, video) for video in video_files))
+        first = probes[0]
+        
+        # TS concat only works when every input has the same streams
+        bitstream_filters = {'h264': 'h264_mp4toannexb', 'hevc': 'hevc_mp4toannexb'}
+        if first['video_codec'] not in bitstream_filters:
+            logger.info(f"MPEG-TS remux not supported for codec {first['video_codec']}")
+            return False
+        stream_keys = [
+            'video_codec', 'video_profile', 'width', 'height', 'pix_fmt',
+            'audio_codec', 'sample_rate', 'channels',
+        ]
+        for probe in probes[1:]:
+            differing = [key for key in stream_keys if probe[key] != first[key]]
+            if differing:
+                logger.info(f"Inputs differ in {', '.join(differing)}, skipping MPEG-TS remux")
+                return False
+        
+        # Private directory so concurrent merges don't touch each other's parts
+        parts_dir = tempfile.mkdtemp(prefix='ts_', dir=self.temp_dir)
+        ts_files = [os.path.join(parts_dir, f'part_{idx}.ts') for idx in range(len(video_files))]
+        try:
+            # Remux all inputs at the same time, this is I/O bound
+            remux_cmds = [
+                [
+                    'ffmpeg',
+                    '-i', video,
+                    '-map', '0:v:0',
+                    '-map', '0:a:0?',
+                    '-c', 'copy',
+                    '-bsf:v', bitstream_filters[first['video_codec']],
+                    '-f', 'mpegts',
+                    '-y',
+                    ts_file
+                ]
+                for video, ts_file in zip(video_files, ts_files)
+            ]
+            results = await asyncio.gather(*(
+                asyncio.to_thread(subprocess.run, cmd, capture_output=True, text=True)
+                for cmd in remux_cmds
+            ))
+            for cmd, result in zip(remux_cmds, results):
+                if result.returncode != 0:
+                    logger.warning(f"MPEG-TS remux failed: {' '.join(cmd)}\n{result.stderr[-500:]}")
+                    return False
+            
+            cmd_concat = [
+                'ffmpeg',
+                '-i', 'concat:' + '|'.join(ts_files),
+                '-c', 'copy',
+                '-movflags', '+faststart',
+                '-y',
+                output_file
+            ]
+            if first['audio_codec'] == 'aac':
+                cmd_concat[-2:-2] = ['-bsf:a', 'aac_adtstoasc']
+            
+            logger.info(f"Running MPEG-TS concat: {' '.join(cmd_concat)}")
+            result = await asyncio.to_thread(subprocess.run, cmd_concat, capture_output=True, text=True)
+            if result.returncode != 0 or not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+                logger.warning(f"MPEG-TS concat failed: {result.stderr[-500:]}")
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                return False
+            return True
+        finally:
+            shutil.rmtree(parts_dir, ignore_errors=True)
     
     async def merge_videos(self, video_files: list, status_msg=None) -> str:
         """Merge multiple videos into one"""
@@ -39,8 +473,9 @@ class VideoProcessor:
                     "⏳ Preparing files..."
                 )
             
-            list_file = os.path.join(self.temp_dir, 'videos.txt')
-            with open(list_file, 'w', encoding='utf-8') as f:
+            # Unique names so merges running at the same time don't clash
+            list_fd, list_file = tempfile.mkstemp(prefix='videos_', suffix='.txt', dir=self.temp_dir)
+            with os.fdopen(list_fd, 'w', encoding='utf-8') as f:
                 for video in video_files:
                     # Use absolute path and proper escaping
                     abs_path = os.path.abspath(video)
@@ -57,7 +492,8 @@ class VideoProcessor:
                 content = f.read()
                 logger.info(f"List file contents:\n{content}")
             
-            output_file = os.path.join(self.output_dir, 'merged_output.mp4')
+            output_fd, output_file = tempfile.mkstemp(prefix='merged_', suffix='.mp4', dir=self.output_dir)
+            os.close(output_fd)
             
             if status_msg and hasattr(status_msg, 'edit'):
                 await status_msg.edit(
@@ -67,7 +503,7 @@ class VideoProcessor:
                     "🔧 FFmpeg is working..."
                 )
             
-            # Try copy first (faster), if it fails, re-encode
+            # Try copy first (faster), then MPEG-TS remux, then re-encode
             cmd_copy = [
                 'ffmpeg',
                 '-f', 'concat',
@@ -82,8 +518,26 @@ class VideoProcessor:
             logger.info(f"Trying fast merge (copy): {' '.join(cmd_copy)}")
             result = subprocess.run(cmd_copy, capture_output=True, text=True)
             
-            if result.returncode != 0 or not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
-                logger.warning(f"Fast merge failed, re-encoding... Error: {result.stderr}")
+            merge_failed = result.returncode != 0 or not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+            
+            if merge_failed:
+                logger.warning(f"Fast merge failed, trying MPEG-TS remux... Error: {result.stderr}")
+                
+                if status_msg and hasattr(status_msg, 'edit'):
+                    await status_msg.edit(
+                        "🔄 Processing...\n"
+                        f"📹 Remuxing {len(video_files)} videos without re-encoding...\n"
+                        "⏳ Trying lossless merge..."
+                    )
+                
+                # Remove failed output if exists
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                
+                merge_failed = not await self.concat_via_mpegts(video_files, output_file)
+            
+            if merge_failed:
+                logger.warning("Lossless merge failed, re-encoding...")
                 
                 if status_msg and hasattr(status_msg, 'edit'):
                     await status_msg.edit(
@@ -97,14 +551,18 @@ class VideoProcessor:
                 if os.path.exists(output_file):
                     os.remove(output_file)
                 
+                # Total duration at the largest input resolution
+                probes = await asyncio.gather(*(asyncio.to_thread(self.probe_video, video) for video in video_files))
+                duration = sum(p['duration'] for p in probes)
+                largest = max(probes, key=lambda p: p['width'] * p['height'])
+                profile = self.select_encode_profile(duration, largest['width'], largest['height'])
+                
                 cmd_encode = [
                     'ffmpeg',
                     '-f', 'concat',
                     '-safe', '0',
                     '-i', list_file,
-                    '-c:v', 'libx264',
-                    '-preset', 'veryfast',  # Balance between speed and quality
-                    '-crf', '23',
+                    *self.encode_args(profile),
                     '-c:a', 'aac',
                     '-b:a', '128k',
                     '-movflags', '+faststart',
@@ -112,9 +570,13 @@ class VideoProcessor:
                     '-y',
                     output_file
                 ]
+                scale = self.scale_filter(profile)
+                if scale:
+                    cmd_encode[-2:-2] = ['-vf', scale]
                 
                 logger.info(f"Running re-encode: {' '.join(cmd_encode)}")
-                result = subprocess.run(cmd_encode, capture_output=True, text=True, timeout=3600)
+                pixels = self.output_pixels(profile, largest['width'], largest['height'])
+                result = await self.run_encode(cmd_encode, profile, duration, pixels, timeout=3600)
                 
                 if result.returncode != 0:
                     logger.error(f"FFmpeg stderr: {result.stderr}")
@@ -165,13 +627,14 @@ class VideoProcessor:
                     "⏳ This may take a few minutes..."
                 )
             
+            probe = await asyncio.to_thread(self.probe_video, video_file)
+            profile = self.select_encode_profile(probe['duration'], probe['width'], probe['height'])
+            
             cmd = [
                 'ffmpeg',
                 '-i', video_file,
                 '-i', audio_file,
-                '-c:v', 'libx264',  # Re-encode video
-                '-preset', 'ultrafast',  # Fastest encoding
-                '-crf', '23',
+                *self.encode_args(profile),  # Re-encode video
                 '-c:a', 'aac',   # Encode audio to AAC
                 '-b:a', '128k',
                 '-map', '0:v:0', # Map video from first input
@@ -181,9 +644,13 @@ class VideoProcessor:
                 '-y',
                 output_file
             ]
+            scale = self.scale_filter(profile)
+            if scale:
+                cmd[-2:-2] = ['-vf', scale]
             
             logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            pixels = self.output_pixels(profile, probe['width'], probe['height'])
+            result = await self.run_encode(cmd, profile, probe['duration'], pixels)
             
             if result.returncode != 0:
                 logger.error(f"FFmpeg error: {result.stderr}")
@@ -217,12 +684,19 @@ class VideoProcessor:
                     "⏳ This may take several minutes..."
                 )
             
+            probe = await asyncio.to_thread(self.probe_video, video_file)
+            profile = self.select_encode_profile(probe['duration'], probe['width'], probe['height'])
+            
+            video_filter = f"subtitles='{subtitle_path}'"
+            scale = self.scale_filter(profile)
+            if scale:
+                video_filter += f",{scale}"
+            
             cmd = [
                 'ffmpeg',
                 '-i', video_file,
-                '-vf', f"subtitles='{subtitle_path}'",
-                '-preset', 'ultrafast',
-                '-crf', '23',
+                '-vf', video_filter,
+                *self.encode_args(profile),
                 '-c:a', 'copy',  # Copy audio
                 '-movflags', '+faststart',
                 '-y',
@@ -230,7 +704,8 @@ class VideoProcessor:
             ]
             
             logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            pixels = self.output_pixels(profile, probe['width'], probe['height'])
+            result = await self.run_encode(cmd, profile, probe['duration'], pixels)
             
             if result.returncode != 0:
                 logger.error(f"FFmpeg error: {result.stderr}")
@@ -317,3 +792,210 @@ class VideoProcessor:
         except Exception as e:
             logger.error(f"Error extracting audio: {e}", exc_info=True)
             raise
+    
+    def keyframe_times(self, video_file: str, start: float, end: float, start_time: float = 0.0) -> list:
+        """Keyframes between start and end, on the same timeline as ffmpeg -ss"""
+        # ffprobe works with raw timestamps, ffmpeg -ss counts from the file's start_time
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-skip_frame', 'nokey',  # Only decode keyframes
+            '-read_intervals', f'{start + start_time}%{end + start_time}',
+            '-show_entries', 'frame=pts_time',
+            '-of', 'csv=p=0',
+            video_file
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        times = []
+        for line in result.stdout.splitlines():
+            try:
+                times.append(float(line.strip().strip(',')) - start_time)
+            except ValueError:
+                continue
+        return sorted(t for t in times if start <= t <= end)
+    
+    async def boundary_keyframes(self, video_file: str, start: float, end: float, start_time: float = 0.0):
+        """First keyframe at or after start and last at or before end, or None"""
+        # Only probe short windows next to each cut point instead of the whole range
+        first_key = None
+        window = KEYFRAME_WINDOW_SECONDS
+        low = start
+        while first_key is None and low < end:
+            high = min(end, low + window)
+            times = await asyncio.to_thread(self.keyframe_times, video_file, low, high, start_time)
+            if times:
+                first_key = times[0]
+            low, window = high, window * 2
+        
+        last_key = None
+        window = KEYFRAME_WINDOW_SECONDS
+        high = end
+        while last_key is None and high > start:
+            low = max(start, high - window)
+            times = await asyncio.to_thread(self.keyframe_times, video_file, low, high, start_time)
+            if times:
+                last_key = times[-1]
+            high, window = low, window * 2
+        
+        return first_key, last_key
+    
+    def video_stream_duration(self, video_file: str) -> float:
+        """Duration of the first video stream in seconds, 0 if unknown"""
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=duration',
+            '-of', 'default=nw=1:nk=1',
+            video_file
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        try:
+            return float(result.stdout.strip())
+        except ValueError:
+            return 0.0
+    
+    async def cut_range(self, video_file: str, start: float, end: float, output_file: str, encode_profile=None):
+        """Cut start-end from a video, copying streams or re-encoding with a profile"""
+        cmd = [
+            'ffmpeg',
+            '-ss', repr(start),  # Input seeking: keyframe for copy, exact for re-encode
+            '-i', video_file,
+            '-t', repr(end - start),
+            '-map', '0:v:0',
+            '-map', '0:a:0?',
+        ]
+        if encode_profile:
+            cmd += self.encode_args(encode_profile)
+            # Match the source stream so the parts can be joined without re-encoding
+            if encode_profile.get('x264_profile'):
+                cmd += ['-profile:v', encode_profile['x264_profile']]
+            cmd += ['-pix_fmt', encode_profile.get('pix_fmt') or 'yuv420p', '-c:a', 'aac', '-b:a', '128k']
+        else:
+            cmd += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
+        cmd += ['-y', output_file]
+        
+        logger.info(f"Cutting range: {' '.join(cmd)}")
+        if encode_profile:
+            # Counted as load, but too short (and mostly startup/seek decoding) to measure speed
+            result = await self.run_encode(cmd, encode_profile, 0, 0)
+        else:
+            result = await asyncio.to_thread(subprocess.run, cmd, capture_output=True, text=True)
+        if result.returncode != 0 or not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            logger.error(f"FFmpeg error: {result.stderr}")
+            raise Exception(f"FFmpeg cut failed: {result.stderr[-500:]}")
+        return output_file
+    
+    async def smart_cut(self, video_file: str, start: float, end: float, output_file: str) -> str:
+        """Frame-exact cut that re-encodes only the GOPs at each boundary"""
+        probe = await asyncio.to_thread(self.probe_video, video_file)
+        if probe['video_codec'] != 'h264' or probe['audio_codec'] not in ('aac', None):
+            # Boundary re-encodes must match the copied middle, fall back to keyframe cut
+            logger.info(f"Smart cut not possible for {probe['video_codec']}/{probe['audio_codec']}, cutting at keyframes")
+            return await self.cut_range(video_file, start, end, output_file)
+        
+        first_key, last_key = await self.boundary_keyframes(video_file, start, end, probe['start_time'])
+        
+        def boundary_profile(duration):
+            # Sized for the frames actually re-encoded, not the whole range
+            profile = self.select_encode_profile(duration, probe['width'], probe['height'])
+            profile['scale_height'] = None  # Boundaries must keep the source resolution
+            profile['x264_profile'] = X264_PROFILES.get(probe['video_profile'])
+            profile['pix_fmt'] = probe['pix_fmt']
+            return profile
+        
+        if first_key is None or last_key is None or last_key <= first_key:
+            # Range is inside a single GOP, re-encoding it is cheap
+            return await self.cut_range(video_file, start, end, output_file, boundary_profile(end - start))
+        
+        profile = boundary_profile((first_key - start) + (end - last_key))
+        frame_time = 1 / probe['frame_rate'] if probe['frame_rate'] > 0 else 1 / 25
+        base = os.path.splitext(output_file)[0]
+        parts = []
+        try:
+            if first_key - start > 0.001:
+                parts.append(await self.cut_range(video_file, start, first_key, f'{base}_head.mp4', profile))
+            
+            # Seek half a frame past the keyframe so the copy can't start at the GOP before it
+            body = await self.cut_range(video_file, first_key + frame_time / 2, last_key, f'{base}_body.mp4')
+            parts.append(body)
+            body_duration = await asyncio.to_thread(self.video_stream_duration, body)
+            if abs(body_duration - (last_key - first_key)) > frame_time / 2:
+                logger.warning(
+                    f"Body copy starts off keyframe {first_key:.3f} "
+                    f"({body_duration:.3f}s vs {last_key - first_key:.3f}s), cutting at keyframes"
+                )
+                return await self.cut_range(video_file, start, end, output_file)
+            
+            if end - last_key > 0.001:
+                parts.append(await self.cut_range(video_file, last_key, end, f'{base}_tail.mp4', profile))
+            
+            if len(parts) == 1:
+                os.replace(parts[0], output_file)
+            elif not await self.concat_via_mpegts(parts, output_file):
+                logger.warning("Smart cut join failed, cutting at keyframes")
+                await self.cut_range(video_file, start, end, output_file)
+            return output_file
+        finally:
+            for part in parts:
+                try:
+                    if os.path.exists(part):
+                        os.remove(part)
+                except Exception as e:
+                    logger.warning(f"Could not remove temp file: {e}")
+    
+    async def trim_videos(self, video_files: list, ranges: list, status_msg=None, precise=True) -> str:
+        """Cut time ranges out of each video and merge the clips"""
+        # Private directory so trims running at the same time don't clash
+        work_dir = tempfile.mkdtemp(prefix='trim_', dir=self.temp_dir)
+        try:
+            # Check ranges against the real durations before cutting anything
+            probes = await asyncio.gather(*(asyncio.to_thread(self.probe_video, video) for video in video_files))
+            checked_ranges = []
+            for idx, (probe, file_ranges) in enumerate(zip(probes, ranges)):
+                duration = probe['duration']
+                checked = []
+                for start, end in file_ranges:
+                    if duration > 0:
+                        if start >= duration:
+                            raise Exception(
+                                f"Range {format_timestamp(start)}-{format_timestamp(end)} starts after the end "
+                                f"of video {idx + 1} ({format_timestamp(duration)} long)"
+                            )
+                        end = min(end, duration)
+                    checked.append((start, end))
+                checked_ranges.append(checked)
+            
+            clips = []
+            total = sum(len(file_ranges) for file_ranges in checked_ranges)
+            for idx, (video, file_ranges) in enumerate(zip(video_files, checked_ranges)):
+                for range_idx, (start, end) in enumerate(file_ranges):
+                    if status_msg and hasattr(status_msg, 'edit'):
+                        await status_msg.edit(
+                            "🔄 Processing...\n"
+                            f"✂️ Cutting clip {len(clips) + 1}/{total}...\n"
+                            "⏳ Please wait..."
+                        )
+                    
+                    clip = os.path.join(work_dir, f'clip_{idx}_{range_idx}.mp4')
+                    if precise:
+                        await self.smart_cut(video, start, end, clip)
+                    else:
+                        await self.cut_range(video, start, end, clip)
+                    clips.append(clip)
+            
+            if len(clips) == 1:
+                output_file = os.path.join(self.output_dir, f'trimmed_{os.path.basename(work_dir)}.mp4')
+                os.replace(clips[0], output_file)
+                logger.info(f"✅ Video trimmed successfully: {output_file}")
+                return output_file
+            
+            # Clips from the same sources merge losslessly through the usual concat path
+            return await self.merge_videos(clips, status_msg)
+        
+        except Exception as e:
+            logger.error(f"Error trimming videos: {e}", exc_info=True)
+            raise
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)